@@ -2,8 +2,34 @@ import torch
 import numpy as np
 import requests
 import base64
+import binascii
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from typing import Union
 from PIL import Image
+from torchvision.io import ImageReadMode, decode_image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyvips
+except (ImportError, OSError):
+    # OSError: the binding is installed but libvips itself is missing
+    pyvips = None
+
+try:
+    import httpx
+    import h2  # noqa: F401 - needed by httpx for HTTP/2
+except ImportError:
+    httpx = None
 
 from .nano_banana_pad import (
     NanaBananaPadCalculator,
@@ -12,6 +38,198 @@ from .nano_banana_pad import (
 )
 
 
+logger = logging.getLogger(__name__)
+
+API_BASE = "https://generativelanguage.googleapis.com"
+
+# Retry policy shared by both transports below
+_MAX_RETRIES = 3
+_BACKOFF_FACTOR = 0.5
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Shared session so repeated calls reuse the keep-alive TLS connection
+# instead of handshaking with the API host on every generate()
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    # Only retry when the request was never processed (connect errors) or
+    # the API explicitly refused it (429/5xx). A read error may mean the
+    # POST was already accepted, and re-sending would bill the generation
+    # again or repeat a File API finalize.
+    max_retries=Retry(
+        total=_MAX_RETRIES,
+        connect=_MAX_RETRIES,
+        read=0,
+        other=0,
+        status=_MAX_RETRIES,
+        backoff_factor=_BACKOFF_FACTOR,
+        status_forcelist=_RETRY_STATUSES,
+        allowed_methods=frozenset({"POST", "DELETE"}),
+        raise_on_status=False,
+    ),
+))
+
+
+# With httpx[http2] installed, calls go over one multiplexed HTTP/2
+# connection instead, so concurrent batch requests share a single TLS
+# session. The transport's own retries cover connect errors only, matching
+# connect= above; status retries and exception types are handled in
+# _httpx_request so callers see the same behavior either way.
+_CLIENT = None
+if httpx is not None:
+    _CLIENT = httpx.Client(
+        transport=httpx.HTTPTransport(
+            http2=True,
+            retries=_MAX_RETRIES,
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=8),
+        ),
+    )
+
+
+def _retry_delay(headers, status_code: int, attempt: int) -> float:
+    """Seconds to wait before retry number ``attempt + 1``, as urllib3 would."""
+    retry_after = headers.get("retry-after", "")
+    if status_code in (429, 503) and retry_after.isdigit():
+        return float(retry_after)
+    return _BACKOFF_FACTOR * 2 ** attempt
+
+
+def _httpx_request(method: str, url: str, headers: dict, body, timeout: float):
+    """Send a request over _CLIENT with _SESSION's retry rules and exceptions."""
+    for attempt in range(_MAX_RETRIES + 1):
+        try:
+            resp = _CLIENT.request(method, url, headers=headers, content=body, timeout=timeout)
+        except httpx.ConnectTimeout as e:
+            raise requests.ConnectTimeout(str(e)) from e
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.RequestException(str(e)) from e
+        if resp.status_code not in _RETRY_STATUSES or attempt == _MAX_RETRIES:
+            break
+        time.sleep(_retry_delay(resp.headers, resp.status_code, attempt))
+    
+    if resp.is_error:
+        kind = "Client" if resp.status_code < 500 else "Server"
+        raise requests.HTTPError(f"{resp.status_code} {kind} Error: {resp.reason_phrase} for url: {resp.url}")
+    return resp.headers, resp.content
+
+
+def _request(method: str, url: str, headers: dict, body=None, timeout: float = 120):
+    """Send a request to the API and return (response headers, raw body)."""
+    if _CLIENT is not None:
+        return _httpx_request(method, url, headers, body, timeout)
+    # Hand back the raw bytes so callers parse them directly; resp.json()
+    # would first decode the multi-MB body to a str
+    resp = _SESSION.request(method, url, headers=headers, data=body, timeout=timeout)
+    resp.raise_for_status()
+    return resp.headers, resp.content
+
+
+def _post(url: str, headers: dict, body: bytes):
+    """POST a request body to the API and return (response headers, raw body)."""
+    return _request("POST", url, headers, body)
+
+
+def _json_dumps(obj) -> bytes:
+    """Serialize a request payload, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _json_loads(data: bytes):
+    """Parse a response body from bytes without decoding it to str first."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _upload_file(data: bytes, mime_type: str, api_key: str) -> tuple[str, str]:
+    """Upload raw bytes through the Gemini File API and return (name, uri)."""
+    start_headers, _ = _post(
+        f"{API_BASE}/upload/v1beta/files",
+        {
+            "x-goog-api-key": api_key,
+            "Content-Type": "application/json",
+            "X-Goog-Upload-Protocol": "resumable",
+            "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Header-Content-Length": str(len(data)),
+            "X-Goog-Upload-Header-Content-Type": mime_type,
+        },
+        _json_dumps({"file": {"display_name": "comfyui-input"}}),
+    )
+    _, body = _post(
+        start_headers["x-goog-upload-url"],
+        {
+            "X-Goog-Upload-Offset": "0",
+            "X-Goog-Upload-Command": "upload, finalize",
+        },
+        data,
+    )
+    file = _json_loads(body)["file"]
+    return file["name"], file["uri"]
+
+
+def _delete_file(name: str, api_key: str) -> None:
+    """Delete an uploaded file so it does not count against the File API quota."""
+    try:
+        _request("DELETE", f"{API_BASE}/v1beta/{name}", {"x-goog-api-key": api_key}, timeout=30)
+    except requests.RequestException as e:
+        # The generation result matters more; Gemini expires files after 48h
+        logger.warning("Failed to delete Gemini file %s: %s", name, e)
+
+
+# Above this many pixels, PNG encoding goes through libvips when available
+PYVIPS_MIN_PIXELS = 4 * 1024 * 1024
+
+
+def _encode_png(img_np: np.ndarray) -> BytesIO:
+    """Encode an HWC uint8 image as PNG at low zlib effort.
+
+    PNG keeps the outpainting source lossless; compression level 1 trades a
+    slightly larger upload for far less zlib CPU time. Large images use
+    libvips, whose SIMD filters run without holding the GIL.
+    """
+    h, w, bands = img_np.shape
+    if pyvips is not None and h * w >= PYVIPS_MIN_PIXELS:
+        vips_img = pyvips.Image.new_from_memory(img_np.data, w, h, bands, "uchar")
+        return BytesIO(vips_img.pngsave_buffer(compression=1))
+    buffer = BytesIO()
+    Image.fromarray(img_np).save(buffer, format="PNG", compress_level=1)
+    return buffer
+
+
+def _decode_output(output_bytes: bytes) -> Union[torch.Tensor, np.ndarray]:
+    """Decode API image bytes to HWC uint8.
+
+    Returns a (possibly strided) tensor from torchvision, or a read-only
+    ndarray from the PIL fallback.
+    """
+    try:
+        # libpng/libjpeg decode straight into a CHW tensor
+        buf = torch.frombuffer(bytearray(output_bytes), dtype=torch.uint8)
+        img = decode_image(buf, mode=ImageReadMode.RGB)
+    except RuntimeError:
+        # Formats this torchvision build cannot decode go through PIL
+        img = None
+    # Recent torchvision decodes 16-bit PNGs to uint16; PIL reduces those
+    # to 8-bit RGB, which is what generate()'s /255 expects
+    if img is None or img.dtype != torch.uint8:
+        output_pil = Image.open(BytesIO(output_bytes))
+        # Most responses are already RGB; convert() would copy them anyway
+        if output_pil.mode != "RGB":
+            output_pil = output_pil.convert("RGB")
+        output_pil.load()
+        # asarray's only copy is PIL's tobytes() behind __array_interface__;
+        # generate() copies straight out of the read-only array
+        return np.asarray(output_pil)
+    return img.permute(1, 2, 0)
+
+
 class GeminiImageGenerate:
     """ComfyUI node for Gemini 3 image generation."""
     
@@ -37,52 +255,95 @@ class GeminiImageGenerate:
     FUNCTION = "generate"
     CATEGORY = "image/generate"
 
+    # Upper bound on in-flight API calls for a batched input
+    MAX_CONCURRENT_REQUESTS = 8
+    # PNGs at least this large are sent through the File API as raw bytes
+    # rather than inlined as base64 (+33% size, and near the request limit)
+    FILE_UPLOAD_MIN_BYTES = 4 * 1024 * 1024
+
     def generate(self, image: torch.Tensor, prompt: str, api_key: str, model: str, aspect_ratio: str, resolution: str):
-        # Convert ComfyUI tensor (BHWC, 0-1 float) to base64 PNG
-        img_np = (image[0].cpu().numpy() * 255).astype(np.uint8)
-        pil_img = Image.fromarray(img_np)
-        
-        buffer = BytesIO()
-        pil_img.save(buffer, format="PNG")
-        img_b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+        # Convert ComfyUI tensor (BHWC, 0-1 float) to uint8 for PNG encoding
+        # Quantize on the tensor's own device so no float32 numpy copy is
+        # made, and a CUDA input moves to the host as uint8 (1/4 the bytes)
+        t = image.detach()
+        batch_np = t.mul(255).round_().clamp_(0, 255).to(torch.uint8).contiguous().cpu().numpy()
         
         # Build request
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+        url = f"{API_BASE}/v1beta/models/{model}:generateContent"
         headers = {
             "x-goog-api-key": api_key,
             "Content-Type": "application/json",
         }
+        generation_config = {
+            "responseModalities": ["Image"],
+            "imageConfig": {
+                "aspectRatio": aspect_ratio,
+                "imageSize": resolution,
+            },
+        }
+        
+        # Call API once per batch item; latency is dominated by the API, so
+        # the requests are overlapped rather than issued back to back
+        def call(img_np):
+            return self._one_call(url, headers, prompt, generation_config, img_np)
+        
+        workers = min(len(batch_np), self.MAX_CONCURRENT_REQUESTS)
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(call, batch_np))
+        
+        # Convert straight into one preallocated batch; pinned host memory
+        # lets downstream nodes copy it to the GPU asynchronously
+        h, w, c = results[0].shape
+        output_tensor = torch.empty(
+            (len(results), h, w, c),
+            dtype=torch.float32,
+            pin_memory=torch.cuda.is_available(),
+        )
+        for out, img in zip(output_tensor, results):
+            if isinstance(img, np.ndarray):
+                # out is a CPU tensor, so out.numpy() shares its memory
+                np.copyto(out.numpy(), img, casting="unsafe")
+            else:
+                out.copy_(img)
+        output_tensor.div_(255)
+        
+        return (output_tensor,)
+
+    def _one_call(self, url: str, headers: dict, prompt: str, generation_config: dict, img_np: np.ndarray) -> Union[torch.Tensor, np.ndarray]:
+        """Send one HWC uint8 image to the API and return the result as HWC uint8."""
+        buffer = _encode_png(img_np)
+        
+        file_name = None
+        if buffer.getbuffer().nbytes >= self.FILE_UPLOAD_MIN_BYTES:
+            file_name, file_uri = _upload_file(buffer.getvalue(), "image/png", headers["x-goog-api-key"])
+            image_part = {"file_data": {"mime_type": "image/png", "file_uri": file_uri}}
+        else:
+            img_b64 = base64.b64encode(buffer.getbuffer()).decode("ascii")
+            image_part = {"inline_data": {"mime_type": "image/png", "data": img_b64}}
+        
         payload = {
             "contents": [{
                 "parts": [
                     {"text": prompt},
-                    {"inline_data": {"mime_type": "image/png", "data": img_b64}},
+                    image_part,
                 ]
             }],
-            "generationConfig": {
-                "responseModalities": ["Image"],
-                "imageConfig": {
-                    "aspectRatio": aspect_ratio,
-                    "imageSize": resolution,
-                },
-            },
+            "generationConfig": generation_config,
         }
         
-        # Call API
-        resp = requests.post(url, headers=headers, json=payload, timeout=120)
-        resp.raise_for_status()
-        data = resp.json()
+        try:
+            _, body = _post(url, headers, _json_dumps(payload))
+        finally:
+            if file_name is not None:
+                _delete_file(file_name, headers["x-goog-api-key"])
+        data = _json_loads(body)
         
-        # Extract output image
+        # Extract output image; a2b_base64 takes the ASCII str as-is, where
+        # b64decode would first copy it to bytes
         output_b64 = data["candidates"][0]["content"]["parts"][0]["inlineData"]["data"]
-        output_bytes = base64.b64decode(output_b64)
-        output_pil = Image.open(BytesIO(output_bytes)).convert("RGB")
-        
-        # Convert back to ComfyUI tensor (BHWC, 0-1 float)
-        output_np = np.array(output_pil).astype(np.float32) / 255.0
-        output_tensor = torch.from_numpy(output_np).unsqueeze(0)
-        
-        return (output_tensor,)
+        del data
+        output_bytes = binascii.a2b_base64(output_b64)
+        return _decode_output(output_bytes)
 
 
 NODE_CLASS_MAPPINGS = {
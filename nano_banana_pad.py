@@ -3,6 +3,11 @@ ComfyUI custom node to compute padding for Nano Banana Pro target dimensions.
 Maps standard API aspect ratios to actual output dimensions.
 """
 
+from functools import cache, lru_cache
+from typing import NamedTuple, Optional
+
+import numpy as np
+
 # Mapping: API aspect_ratio -> actual output (W, H) per resolution
 # API accepts: 1:1, 3:2, 2:3, 3:4, 4:3, 4:5, 5:4, 9:16, 16:9, 21:9
 DIMENSION_MAP = {
@@ -72,37 +77,74 @@ def get_all_dimensions():
     return dims
 
 
+class _DimensionIndex(NamedTuple):
+    """Lookup tables over get_all_dimensions(), built once per process."""
+    lookup: dict          # (aspect_ratio, resolution) -> (W, H)
+    sorted_w: np.ndarray  # widths sorted by total pixels, smallest first
+    sorted_h: np.ndarray
+    sorted_ar: tuple      # aspect_ratio/resolution in the same order
+    sorted_res: tuple
+    sorted_res_arr: np.ndarray
+
+
+@cache
+def _build_index() -> _DimensionIndex:
+    """Build the dimension index on first use and share it afterwards."""
+    all_dims = get_all_dimensions()
+    dims = np.array([(w, h) for w, h, _, _ in all_dims], dtype=np.int32)
+    areas = dims[:, 0].astype(np.int64) * dims[:, 1]
+    # Stable, so equal areas keep DIMENSION_MAP order
+    order = np.argsort(areas, kind="stable")
+    sorted_res = tuple(all_dims[i][3] for i in order)
+    return _DimensionIndex(
+        lookup={(ar, res): (w, h) for w, h, ar, res in all_dims},
+        sorted_w=dims[order, 0],
+        sorted_h=dims[order, 1],
+        sorted_ar=tuple(all_dims[i][2] for i in order),
+        sorted_res=sorted_res,
+        sorted_res_arr=np.array(sorted_res),
+    )
+
+
 def get_dimensions(aspect_ratio: str, resolution: str) -> tuple[int, int]:
     """Get (W, H) for a specific aspect_ratio and resolution."""
-    if aspect_ratio not in DIMENSION_MAP:
-        raise ValueError(f"Unknown aspect_ratio: {aspect_ratio}")
-    if resolution not in DIMENSION_MAP[aspect_ratio]:
-        raise ValueError(f"Unknown resolution: {resolution}")
-    return DIMENSION_MAP[aspect_ratio][resolution]
+    try:
+        return _build_index().lookup[(aspect_ratio, resolution)]
+    except KeyError:
+        if aspect_ratio not in DIMENSION_MAP:
+            raise ValueError(f"Unknown aspect_ratio: {aspect_ratio}") from None
+        raise ValueError(f"Unknown resolution: {resolution}") from None
 
 
-def find_best_fit(W: int, H: int, must_grow: bool = True) -> tuple[str, str]:
-    """Find smallest supported dimension that contains the image."""
-    all_dims = get_all_dimensions()
-    
+def _smallest_fit(W: int, H: int, must_grow: bool, resolution: Optional[str] = None) -> Optional[tuple[str, str]]:
+    """(aspect_ratio, resolution) of the smallest dimension containing WxH, or None."""
+    index = _build_index()
+    mask = (index.sorted_w >= W) & (index.sorted_h >= H)
     if must_grow:
-        candidates = [(w, h, ar, res) for w, h, ar, res in all_dims 
-                      if w >= W and h >= H and (w > W or h > H)]
-    else:
-        candidates = [(w, h, ar, res) for w, h, ar, res in all_dims 
-                      if w >= W and h >= H]
+        mask &= (index.sorted_w > W) | (index.sorted_h > H)
+    if resolution is not None:
+        mask &= index.sorted_res_arr == resolution
+    if not mask.any():
+        return None
+    i = int(np.argmax(mask))
+    return index.sorted_ar[i], index.sorted_res[i]
+
+
+@lru_cache(maxsize=256)
+def find_best_fit(W: int, H: int, must_grow: bool = True) -> tuple[str, str]:
+    """Find smallest supported dimension that contains the image.
+
+    Cached, since workflows commonly re-run with the same source size.
+    """
+    best = _smallest_fit(W, H, must_grow)
     
-    if not candidates:
+    if best is None:
         raise ValueError(
             f"Image {W}x{H} exceeds all supported sizes. "
             f"Maximum supported is 6336x2688 (21:9 @ 4K) or 3072x5504 (9:16 @ 4K)."
         )
     
-    # Sort by total pixels (smallest first)
-    candidates.sort(key=lambda x: x[0] * x[1])
-    _, _, best_ar, best_res = candidates[0]
-    
-    return best_ar, best_res
+    return best
 
 
 class NanaBananaPadCalculator:
@@ -113,8 +155,8 @@ class NanaBananaPadCalculator:
         return {
             "required": {
                 "image": ("IMAGE",),
-                "aspect_ratio": ("STRING", {"default": "auto"}),
-                "resolution": ("STRING", {"default": "auto"}),
+                "aspect_ratio": (VALID_ASPECT_RATIOS, {"default": "auto"}),
+                "resolution": (VALID_RESOLUTIONS, {"default": "auto"}),
             }
         }
     
@@ -127,11 +169,8 @@ class NanaBananaPadCalculator:
         # image shape: (batch, H, W, C)
         _, H, W, _ = image.shape
         
-        # Validate inputs
-        if aspect_ratio not in VALID_ASPECT_RATIOS:
-            raise ValueError(f"Invalid aspect_ratio '{aspect_ratio}'. Valid: {VALID_ASPECT_RATIOS}")
-        if resolution not in VALID_RESOLUTIONS:
-            raise ValueError(f"Invalid resolution '{resolution}'. Valid: {VALID_RESOLUTIONS}")
+        # aspect_ratio/resolution are combo inputs, so ComfyUI has already
+        # validated them against VALID_ASPECT_RATIOS/VALID_RESOLUTIONS
         
         # Handle auto modes
         if aspect_ratio == "auto" and resolution == "auto":
@@ -139,19 +178,13 @@ class NanaBananaPadCalculator:
         
         elif aspect_ratio == "auto":
             # Fixed resolution, find best aspect ratio (must be strictly larger)
-            candidates = []
-            for api_ratio, res_map in DIMENSION_MAP.items():
-                if resolution in res_map:
-                    tw, th = res_map[resolution]
-                    if tw >= W and th >= H and (tw > W or th > H):
-                        candidates.append((tw * th, api_ratio))
+            best = _smallest_fit(W, H, must_grow=True, resolution=resolution)
             
-            if not candidates:
+            if best is None:
                 raise ValueError(
                     f"Image {W}x{H} too large for {resolution}. Choose higher resolution."
                 )
-            candidates.sort()
-            aspect_ratio = candidates[0][1]
+            aspect_ratio = best[0]
         
         elif resolution == "auto":
             # Fixed aspect ratio, find smallest resolution that is strictly larger
@@ -174,15 +207,11 @@ class NanaBananaPadCalculator:
                 f"Choose a higher resolution or different aspect ratio."
             )
         
-        pad_h = tw - W
-        pad_v = th - H
-        
-        pad_left = pad_h // 2
-        pad_right = pad_h - pad_left
-        pad_top = pad_v // 2
-        pad_bottom = pad_v - pad_top
+        # Center the image; any odd pixel goes to the right/bottom
+        pad_left, rem_h = divmod(tw - W, 2)
+        pad_top, rem_v = divmod(th - H, 2)
         
-        return (pad_left, pad_right, pad_top, pad_bottom, tw, th, aspect_ratio, resolution)
+        return (pad_left, pad_left + rem_h, pad_top, pad_top + rem_v, tw, th, aspect_ratio, resolution)
 
 
 NODE_CLASS_MAPPINGS = {